@@ -0,0 +1,135 @@
+"""
+Shared Kafka request framing helpers for the Python test scripts.
+"""
+
+import selectors
+import struct
+
+# Precompiled struct formats, so the format strings are parsed only once
+_LEN = struct.Struct('>I')    # Message length (4 bytes, big-endian)
+_HDR = struct.Struct('>hhi')  # API Key, API Version, Correlation ID
+_H = struct.Struct('>h')      # NULLABLE_STRING length (2 bytes, big-endian)
+_I = struct.Struct('>i')      # INT32 (4 bytes, big-endian)
+
+def api_versions_request(client_id, correlation_id=1):
+    """
+    Creates an ApiVersions request (API key 18) for the given client_id bytes.
+    This is a simple request that Kafka clients typically send first.
+    """
+    # RequestHeaderV2:
+    # - API Key: 18 (ApiVersions)
+    # - API Version: 1
+    # - Correlation ID
+    # - Client ID (nullable string)
+    # - Tagged fields: empty (0 byte)
+
+    api_key = 18  # ApiVersions
+    api_version = 1
+    n = len(client_id)
+
+    # For ApiVersions request, there's typically no body after the header
+    # The message length should include everything after the length field
+    message_length = _HDR.size + _H.size + n + 1
+
+    # Build the complete message: [message_length] + [header] in one buffer
+    buf = bytearray(_LEN.size + message_length)
+    mv = memoryview(buf)
+    _LEN.pack_into(buf, 0, message_length)
+    _HDR.pack_into(buf, 4, api_key, api_version, correlation_id)
+
+    # Client ID as NULLABLE_STRING
+    _H.pack_into(buf, 12, n)  # String length
+    mv[14:14 + n] = client_id  # String content, copied in place
+
+    # Tagged fields (empty for now)
+    buf[-1] = 0  # No tagged fields
+
+    return bytes(buf)
+
+def metadata_request(correlation_id=2):
+    """
+    Creates a Metadata request (API key 3) with null client_id.
+    Returns the (length, header, body) segments separately, for sending with
+    a single scatter-gather socket.sendmsg() call instead of concatenating.
+    """
+    api_key = 3  # Metadata
+    api_version = 1
+
+    # Header: API Key, API Version, Correlation ID, null Client ID, tagged fields
+    header = bytearray(_HDR.size + _H.size + 1)
+    _HDR.pack_into(header, 0, api_key, api_version, correlation_id)
+
+    # Client ID as NULL NULLABLE_STRING
+    _H.pack_into(header, 8, -1)  # -1 means null
+
+    # Tagged fields (empty)
+    header[10] = 0
+
+    # Add a simple metadata request body (empty topic list)
+    body = _I.pack(0)  # Empty topic list (0 topics)
+
+    length = _LEN.pack(len(header) + len(body))
+    return length, bytes(header), body
+
+def recv_frame(sock, buf=bytearray(65536)):
+    """
+    Reads exactly one length-prefixed Kafka frame into a reusable buffer.
+    Returns a memoryview of the frame (length prefix included) that is only
+    valid until the next call using the same buffer.
+    """
+    mv = memoryview(buf)
+
+    # Read the 4-byte length prefix
+    off = 0
+    while off < 4:
+        n = sock.recv_into(mv[off:4])
+        if n == 0:
+            raise ConnectionError("Connection closed by broker")
+        off += n
+
+    frame_end = 4 + _LEN.unpack_from(buf)[0]
+    if frame_end > len(buf):
+        raise ValueError(f"Frame of {frame_end} bytes does not fit in {len(buf)} byte buffer")
+
+    # Read the frame body into the same buffer
+    while off < frame_end:
+        n = sock.recv_into(mv[off:frame_end])
+        if n == 0:
+            raise ConnectionError("Connection closed by broker")
+        off += n
+
+    return mv[:frame_end]
+
+def recv_frames(sock, count, timeout=1.0, buf=bytearray(65536)):
+    """
+    Reads up to count pipelined length-prefixed frames, waiting on a selector
+    instead of blocking in recv. Returns copies of the complete frames; fewer
+    than count are returned if the socket is idle for timeout seconds or closed.
+    Any bytes received past the last complete frame are discarded.
+    """
+    mv = memoryview(buf)
+    frames = []
+    filled = start = 0
+
+    previous_timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        with selectors.DefaultSelector() as sel:
+            sel.register(sock, selectors.EVENT_READ)
+            while len(frames) < count and sel.select(timeout):
+                n = sock.recv_into(mv[filled:])
+                if n == 0:
+                    break
+                filled += n
+
+                # Split off every frame that is complete so far
+                while filled - start >= 4:
+                    frame_end = start + 4 + _LEN.unpack_from(buf, start)[0]
+                    if frame_end > filled:
+                        break
+                    frames.append(bytes(mv[start:frame_end]))
+                    start = frame_end
+    finally:
+        sock.settimeout(previous_timeout)
+
+    return frames
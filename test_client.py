@@ -5,82 +5,19 @@ This mimics what a real Kafka client would send.
 """
 
 import socket
-import struct
+import sys
 
-def create_api_versions_request():
-    """
-    Creates an ApiVersions request (API key 18).
-    This is a simple request that Kafka clients typically send first.
-    """
-    # RequestHeaderV2:
-    # - API Key: 18 (ApiVersions)
-    # - API Version: 1
-    # - Correlation ID: 1
-    # - Client ID: "test-client" (nullable string)
-    # - Tagged fields: empty (0 byte)
-    
-    api_key = 18  # ApiVersions
-    api_version = 1
-    correlation_id = 1
-    client_id = "test-client"
-    
-    # Build the request header
-    header = bytearray()
-    header.extend(struct.pack('>h', api_key))  # API Key (2 bytes, big-endian)
-    header.extend(struct.pack('>h', api_version))  # API Version (2 bytes, big-endian)
-    header.extend(struct.pack('>i', correlation_id))  # Correlation ID (4 bytes, big-endian)
-    
-    # Client ID as NULLABLE_STRING
-    client_id_bytes = client_id.encode('utf-8')
-    header.extend(struct.pack('>h', len(client_id_bytes)))  # String length (2 bytes, big-endian)
-    header.extend(client_id_bytes)  # String content
-    
-    # Tagged fields (empty for now)
-    header.append(0)  # No tagged fields
-    
-    # For ApiVersions request, there's typically no body after the header
-    # The message length should include everything after the length field
-    message_length = len(header)
-    
-    # Build the complete message: [message_length] + [header]
-    message = bytearray()
-    message.extend(struct.pack('>I', message_length))  # Message length (4 bytes, big-endian)
-    message.extend(header)
-    
-    return bytes(message)
+from _kafka_frames import api_versions_request, metadata_request, recv_frames
 
-def create_metadata_request():
-    """
-    Creates a Metadata request (API key 3) with null client_id.
-    """
-    api_key = 3  # Metadata
-    api_version = 1
-    correlation_id = 2
-    
-    # Build the request header
-    header = bytearray()
-    header.extend(struct.pack('>h', api_key))  # API Key
-    header.extend(struct.pack('>h', api_version))  # API Version
-    header.extend(struct.pack('>i', correlation_id))  # Correlation ID
-    
-    # Client ID as NULL NULLABLE_STRING
-    header.extend(struct.pack('>h', -1))  # -1 means null
-    
-    # Tagged fields (empty)
-    header.append(0)
-    
-    # Add a simple metadata request body (empty topic list)
-    body = bytearray()
-    body.extend(struct.pack('>i', 0))  # Empty topic list (0 topics)
-    
-    # Complete message
-    message_length = len(header) + len(body)
-    message = bytearray()
-    message.extend(struct.pack('>I', message_length))
-    message.extend(header)
-    message.extend(body)
-    
-    return bytes(message)
+# Hex dumps are only built when asked for with -v
+VERBOSE = '-v' in sys.argv
+
+# Client ID, already UTF-8 encoded
+_CID = b"test-client"
+
+# Both requests only have literal inputs, so build them once at import
+_API_VERSIONS_BYTES = api_versions_request(_CID)
+_METADATA_SEGMENTS = metadata_request()
 
 def test_broker():
     """
@@ -90,42 +27,41 @@ def test_broker():
         # Connect to broker
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.connect(('127.0.0.1', 9092))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Disable Nagle's algorithm
         
         print("Connected to broker")
         
-        # Test 1: Send ApiVersions request with client_id
-        print("\n=== Test 1: ApiVersions request with client_id ===")
-        request1 = create_api_versions_request()
-        print(f"Sending {len(request1)} bytes:")
-        print("Hex dump:", request1.hex())
+        # Both requests are prebuilt so they can be pipelined
+        request1 = _API_VERSIONS_BYTES  # ApiVersions request with client_id
+        request2 = _METADATA_SEGMENTS  # Metadata request with null client_id
         
-        sock.send(request1)
+        # Send both frames in a single scatter-gather syscall
+        sock.sendmsg([request1, *request2])
         
-        # Try to read response
-        try:
-            response = sock.recv(1024)
-            print(f"Received {len(response)} bytes response")
-            if response:
-                print("Response hex:", response.hex())
-        except socket.timeout:
+        # Wait on a selector until both length-prefixed responses have arrived
+        responses = recv_frames(sock, 2)
+        if len(responses) < 2:
             print("No response received (timeout)")
         
-        # Test 2: Send Metadata request with null client_id
-        print("\n=== Test 2: Metadata request with null client_id ===")
-        request2 = create_metadata_request()
-        print(f"Sending {len(request2)} bytes:")
-        print("Hex dump:", request2.hex())
-        
-        sock.send(request2)
+        # Test 1: ApiVersions request with client_id
+        print("\n=== Test 1: ApiVersions request with client_id ===")
+        print(f"Sent {len(request1)} bytes")
+        if VERBOSE:
+            print("Hex dump:", request1.hex())
+        if len(responses) > 0:
+            print(f"Received {len(responses[0])} bytes response")
+            if VERBOSE:
+                print("Response hex:", responses[0].hex())
         
-        # Try to read response
-        try:
-            response = sock.recv(1024)
-            print(f"Received {len(response)} bytes response")
-            if response:
-                print("Response hex:", response.hex())
-        except socket.timeout:
-            print("No response received (timeout)")
+        # Test 2: Metadata request with null client_id
+        print("\n=== Test 2: Metadata request with null client_id ===")
+        print(f"Sent {sum(map(len, request2))} bytes")
+        if VERBOSE:
+            print("Hex dump:", b''.join(request2).hex())
+        if len(responses) > 1:
+            print(f"Received {len(responses[1])} bytes response")
+            if VERBOSE:
+                print("Response hex:", responses[1].hex())
         
         sock.close()
         print("\nConnection closed")
@@ -5,60 +5,72 @@ This script tests that the server properly handles active connections during shu
 """
 
 import socket
-import struct
 import threading
 import time
 import subprocess
 import signal
 import os
 import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 
-def create_api_versions_request():
-    """Creates an ApiVersions request."""
-    api_key = 18  # ApiVersions
-    api_version = 1
-    correlation_id = 1
-    client_id = "shutdown-test-client"
-    
-    # Build the request header
-    header = bytearray()
-    header.extend(struct.pack('>h', api_key))
-    header.extend(struct.pack('>h', api_version))
-    header.extend(struct.pack('>i', correlation_id))
-    
-    # Client ID as NULLABLE_STRING
-    client_id_bytes = client_id.encode('utf-8')
-    header.extend(struct.pack('>h', len(client_id_bytes)))
-    header.extend(client_id_bytes)
-    
-    # Tagged fields (empty)
-    header.append(0)
-    
-    # Complete message
-    message_length = len(header)
-    message = bytearray()
-    message.extend(struct.pack('>I', message_length))
-    message.extend(header)
-    
-    return bytes(message)
+from _kafka_frames import api_versions_request, recv_frame
+
+# Hex dumps are only built when asked for with -v
+VERBOSE = '-v' in sys.argv
+
+# Run the release binary directly instead of going through `cargo run`
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+BROKER_BINARY = os.path.join(PROJECT_DIR, 'target', 'release', 'codecrafters-kafka')
+
+def build_broker():
+    """Builds the release broker binary (a no-op if cargo finds it up to date)."""
+    subprocess.run(['cargo', 'build', '--release'], cwd=PROJECT_DIR, check=True)
+
+def wait_ready(port=9092, timeout=5.0):
+    """
+    Retries connecting to the broker port every 10ms until it accepts
+    connections, raising TimeoutError if it isn't up within timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.01)
+    raise TimeoutError(f"Broker did not start listening on port {port} within {timeout}s")
+
+# Client ID, already UTF-8 encoded
+_CID = b"shutdown-test-client"
 
-def long_running_client(client_id, duration=5):
+# The request is identical for every client, so serialize it once and share it
+_API_VERSIONS_REQUEST_BYTES = api_versions_request(_CID)
+
+def long_running_client(client_id, duration=5, barrier=None):
     """
     Simulates a long-running client connection.
+    If a barrier is given, waits on it after connecting so that all clients
+    send their requests at the same time.
     """
     try:
         print(f"[Client {client_id}] Connecting to broker...")
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.settimeout(10)  # 10 second timeout
         sock.connect(('127.0.0.1', 9092))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Disable Nagle's algorithm
+        
+        # Wait for the other clients to connect
+        if barrier is not None:
+            barrier.wait(timeout=10)
         
         print(f"[Client {client_id}] Connected, sending request...")
-        request = create_api_versions_request()
-        sock.send(request)
+        sock.sendall(_API_VERSIONS_REQUEST_BYTES)
         
-        # Try to read response
+        # Try to read response (each client thread gets its own buffer)
         try:
-            response = sock.recv(1024)
+            response = recv_frame(sock, bytearray(65536))
             print(f"[Client {client_id}] Received {len(response)} bytes response")
         except socket.timeout:
             print(f"[Client {client_id}] No response received (timeout)")
@@ -71,7 +83,10 @@ def long_running_client(client_id, duration=5):
         print(f"[Client {client_id}] Connection closed normally")
         
     except Exception as e:
-        print(f"[Client {client_id}] Error: {e}")
+        # Release the other clients if we never reached the barrier
+        if barrier is not None:
+            barrier.abort()
+        print(f"[Client {client_id}] Error: {e!r}")
 
 def test_graceful_shutdown():
     """
@@ -81,30 +96,26 @@ def test_graceful_shutdown():
     
     # Start the Kafka broker
     print("Starting Kafka broker...")
+    broker_log = tempfile.TemporaryFile()  # A file never fills up like a pipe can
     broker_process = subprocess.Popen(
-        ['cargo', 'run'],
-        stdout=subprocess.PIPE,
+        [BROKER_BINARY],
+        stdout=broker_log,
         stderr=subprocess.STDOUT,
-        text=True,
         preexec_fn=os.setsid  # Create a new process group
     )
     
-    # Wait a bit for the broker to start
-    time.sleep(2)
+    # Wait for the broker to start
+    wait_ready()
     
     # Start multiple client connections
     print("Starting client connections...")
-    client_threads = []
-    
-    for i in range(3):
-        thread = threading.Thread(
-            target=long_running_client, 
-            args=(i+1, 8),  # Each client stays connected for 8 seconds
-            daemon=True
-        )
-        client_threads.append(thread)
-        thread.start()
-        time.sleep(0.5)  # Stagger connection starts
+    barrier = threading.Barrier(3)  # All clients connect, then send together
+    client_pool = ThreadPoolExecutor(max_workers=3)
+    client_futures = [
+        # Each client stays connected for 8 seconds
+        client_pool.submit(long_running_client, i+1, 8, barrier)
+        for i in range(3)
+    ]
     
     # Wait a bit to let connections establish
     time.sleep(2)
@@ -120,20 +131,25 @@ def test_graceful_shutdown():
     # Monitor broker output
     print("Monitoring broker shutdown...")
     try:
-        stdout, _ = broker_process.communicate(timeout=35)  # Wait up to 35 seconds
+        broker_process.wait(timeout=35)  # Wait up to 35 seconds
         print("Broker output:")
-        print(stdout)
     except subprocess.TimeoutExpired:
         print("Broker shutdown timed out")
         broker_process.kill()
-        stdout, _ = broker_process.communicate()
+        broker_process.wait()
         print("Broker output (after force kill):")
-        print(stdout)
+    broker_log.seek(0)
+    print(broker_log.read().decode('utf-8', 'replace'))
+    broker_log.close()
     
     # Wait for client threads to finish
     print("Waiting for client threads to finish...")
-    for thread in client_threads:
-        thread.join(timeout=5)
+    try:
+        for future in as_completed(client_futures, timeout=10):
+            future.result()
+    except FuturesTimeoutError:
+        print("Timed out waiting for client threads")
+    client_pool.shutdown(wait=False)
     
     print("Graceful shutdown test completed!")
     return broker_process.returncode
@@ -146,16 +162,16 @@ def test_basic_functionality():
     
     # Start the broker
     print("Starting Kafka broker...")
+    broker_log = tempfile.TemporaryFile()
     broker_process = subprocess.Popen(
-        ['cargo', 'run'],
-        stdout=subprocess.PIPE,
+        [BROKER_BINARY],
+        stdout=broker_log,
         stderr=subprocess.STDOUT,
-        text=True,
         preexec_fn=os.setsid
     )
     
     # Wait for broker to start
-    time.sleep(2)
+    wait_ready()
     
     # Test a simple connection
     try:
@@ -163,12 +179,14 @@ def test_basic_functionality():
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.settimeout(5)
         sock.connect(('127.0.0.1', 9092))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Disable Nagle's algorithm
         
-        request = create_api_versions_request()
-        sock.send(request)
+        sock.sendall(_API_VERSIONS_REQUEST_BYTES)
         
-        response = sock.recv(1024)
-        print(f"Received {len(response)} bytes response: {response.hex()}")
+        response = recv_frame(sock)
+        print(f"Received {len(response)} bytes response")
+        if VERBOSE:
+            print("Response hex:", response.hex())
         
         sock.close()
         print("Basic functionality test passed!")
@@ -183,11 +201,14 @@ def test_basic_functionality():
         broker_process.wait(timeout=10)
     except (ProcessLookupError, subprocess.TimeoutExpired):
         broker_process.kill()
+    broker_log.close()
     
     return True
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1 and sys.argv[1] == "--graceful-shutdown":
+    build_broker()
+    
+    if "--graceful-shutdown" in sys.argv[1:]:
         # Test graceful shutdown
         exit_code = test_graceful_shutdown()
         sys.exit(exit_code if exit_code is not None else 0)